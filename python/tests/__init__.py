@@ -5,7 +5,7 @@ import os
 # Add the parent directory to the path to import versioned_ds
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from versioned_ds import SimpleKafka
+from versioned_ds import SimpleKafka, TIME_INDEX_SUFFIX, format_ts, parse_ts
 from time_ds import CalendarQueue
 
-__all__ = ['SimpleKafka', 'CalendarQueue'] 
+__all__ = ['SimpleKafka', 'CalendarQueue', 'TIME_INDEX_SUFFIX', 'format_ts', 'parse_ts'] 
@@ -1,5 +1,6 @@
 import unittest
 import sys
+import random
 from . import CalendarQueue
 
 
@@ -17,7 +18,7 @@ class TestCalendarQueue(unittest.TestCase):
         self.assertEqual(cq.current_time, 0.0)
         self.assertEqual(cq.event_count, 0)
         self.assertEqual(cq.last_bucket, 0)
-        self.assertEqual(len(cq.buckets), 8)
+        self.assertEqual(len(cq.bucket_ts), 8)
         self.assertTrue(cq.is_empty())
     
     def test_initialization_custom(self):
@@ -25,7 +26,14 @@ class TestCalendarQueue(unittest.TestCase):
         cq = CalendarQueue(bucket_width=2.5, initial_buckets=16)
         self.assertEqual(cq.bucket_width, 2.5)
         self.assertEqual(cq.num_buckets, 16)
-        self.assertEqual(len(cq.buckets), 16)
+        self.assertEqual(len(cq.bucket_ts), 16)
+    
+    def test_initialization_non_power_of_two_buckets_raises_error(self):
+        """Test that the bucket count must be a power of 2."""
+        for initial_buckets in (0, 6, 12):
+            with self.assertRaises(ValueError) as context:
+                CalendarQueue(initial_buckets=initial_buckets)
+            self.assertIn("power of 2", str(context.exception))
     
     def test_enqueue_single_event(self):
         """Test enqueueing a single event."""
@@ -81,6 +89,16 @@ class TestCalendarQueue(unittest.TestCase):
         
         self.assertTrue(self.cq.is_empty())
     
+    def test_same_timestamp_dequeued_in_insertion_order(self):
+        """Test that events sharing a timestamp come out first-in, first-out."""
+        self.cq.enqueue(5.0, {"id": 1})
+        self.cq.enqueue(5.0, {"id": 2})
+        self.cq.enqueue(5.0, {"id": 3})
+        
+        for expected_id in (1, 2, 3):
+            _, event = self.cq.dequeue()
+            self.assertEqual(event["id"], expected_id)
+    
     def test_dequeue_empty_queue_raises_error(self):
         """Test that dequeueing from empty queue raises IndexError."""
         with self.assertRaises(IndexError) as context:
@@ -165,6 +183,45 @@ class TestCalendarQueue(unittest.TestCase):
             self.assertEqual(timestamp, i * 0.1)
             self.assertEqual(event, f"event_{i}")
     
+    def test_peek_none_event(self):
+        """Test that peek returns events whose payload is None."""
+        self.cq.enqueue(2.0, None)
+        self.assertEqual(self.cq.peek(), (2.0, None))
+    
+    def test_sparse_events_far_apart(self):
+        """Test ordering when events are spread over many bucket widths."""
+        cq = CalendarQueue(bucket_width=1.0, initial_buckets=64)
+        for timestamp in (1000.0, 3.0, 250.5, 77.0):
+            cq.enqueue(timestamp, str(timestamp))
+        
+        for expected_timestamp in (3.0, 77.0, 250.5, 1000.0):
+            timestamp, event = cq.dequeue()
+            self.assertEqual(timestamp, expected_timestamp)
+            self.assertEqual(event, str(expected_timestamp))
+    
+    def test_interleaved_operations_match_sorted_order(self):
+        """Test random interleaved enqueue/dequeue against a sorted reference list."""
+        rng = random.Random(42)
+        reference = []
+        seq = 0
+        
+        for _ in range(2000):
+            if reference and rng.random() < 0.45:
+                expected_timestamp, _, expected_event = reference.pop(0)
+                self.assertEqual(self.cq.peek(), (expected_timestamp, expected_event))
+                self.assertEqual(self.cq.dequeue(), (expected_timestamp, expected_event))
+            else:
+                timestamp = self.cq.current_time + rng.choice([0.0, rng.random(), rng.random() * 50])
+                self.cq.enqueue(timestamp, seq)
+                reference.append((timestamp, seq, seq))
+                reference.sort()
+                seq += 1
+        
+        while reference:
+            expected_timestamp, _, expected_event = reference.pop(0)
+            self.assertEqual(self.cq.dequeue(), (expected_timestamp, expected_event))
+        self.assertTrue(self.cq.is_empty())
+    
     def test_events_at_current_time_boundary(self):
         """Test events exactly at current_time boundary."""
         self.cq.current_time = 5.0
@@ -175,6 +232,28 @@ class TestCalendarQueue(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.cq.enqueue(4.9, "in_past")
     
+    def test_moving_current_time_forward_drops_past_events(self):
+        """Test that events left behind by a manual current_time change are skipped."""
+        for timestamp in (1.0, 2.0, 3.0, 12.0):
+            self.cq.enqueue(timestamp, str(timestamp))
+        
+        self.cq.current_time = 2.5
+        self.assertEqual(self.cq.peek(), (3.0, "3.0"))
+        self.assertEqual(self.cq.event_count, 2)
+        self.assertEqual(self.cq.dequeue(), (3.0, "3.0"))
+        self.assertEqual(self.cq.dequeue(), (12.0, "12.0"))
+    
+    def test_moving_current_time_back_allows_earlier_events(self):
+        """Test scheduling before the last dequeued event after rewinding current_time."""
+        self.cq.enqueue(20.0, "late")
+        self.cq.enqueue(21.5, "later")
+        self.cq.dequeue()
+        
+        self.cq.current_time = 5.0
+        self.cq.enqueue(6.0, "early")
+        self.assertEqual(self.cq.dequeue(), (6.0, "early"))
+        self.assertEqual(self.cq.dequeue(), (21.5, "later"))
+    
     def test_resize_triggers_dense_queue(self):
         """Test that queue resizes when it becomes too dense."""
         initial_buckets = self.cq.num_buckets
@@ -196,6 +275,15 @@ class TestCalendarQueue(unittest.TestCase):
         self.assertEqual(self.cq.event_count, num_events)
         self.assertFalse(self.cq.is_empty())
     
+    def test_resize_adapts_bucket_width_to_event_spacing(self):
+        """Test that growing narrows buckets so dense events stay spread out."""
+        rng = random.Random(7)
+        for i in range(1000):
+            self.cq.enqueue(rng.random(), i)
+        
+        self.assertLess(self.cq.bucket_width, 1.0)
+        self.assertLessEqual(max(len(bucket_ts) for bucket_ts in self.cq.bucket_ts), 32)
+    
     def test_resize_triggers_sparse_queue(self):
         """Test that queue resizes when it becomes too sparse."""
         for i in range(20):
@@ -249,8 +337,13 @@ class TestCalendarQueue(unittest.TestCase):
     
     def test_edge_case_negative_bucket_width_initialization(self):
         """Test initialization with negative bucket width."""
-        cq = CalendarQueue(bucket_width=-1.0)
-        self.assertEqual(cq.bucket_width, -1.0)
+        with self.assertRaises(ValueError):
+            CalendarQueue(bucket_width=-1.0)
+    
+    def test_edge_case_zero_bucket_width_initialization(self):
+        """Test initialization with zero bucket width."""
+        with self.assertRaises(ValueError):
+            CalendarQueue(bucket_width=0)
 
 
 if __name__ == '__main__':
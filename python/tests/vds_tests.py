@@ -2,8 +2,21 @@ import unittest
 import json
 import os
 import tempfile
+import uuid
+from dataclasses import dataclass
 from datetime import datetime
-from . import SimpleKafka
+from enum import Enum
+from . import SimpleKafka, TIME_INDEX_SUFFIX, format_ts, parse_ts
+
+
+class Color(Enum):
+    RED = "red"
+
+
+@dataclass
+class Point:
+    x: int
+    y: int
 
 
 class TestSimpleKafka(unittest.TestCase):
@@ -12,14 +25,24 @@ class TestSimpleKafka(unittest.TestCase):
         self.temp_file = None
     
     def tearDown(self):
-        if self.temp_file and os.path.exists(self.temp_file):
-            os.remove(self.temp_file)
+        if self.temp_file:
+            for path in (self.temp_file, self.temp_file + TIME_INDEX_SUFFIX):
+                if os.path.exists(path):
+                    os.remove(path)
+    
+    def _temp_log(self, content: str = '') -> str:
+        """Create a temporary log file holding content, removed again in tearDown"""
+        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.json') as tmp:
+            tmp.write(content)
+            self.temp_file = tmp.name
+        return self.temp_file
     
     def test_init_without_file_path(self):
         """Test initialization without file path"""
         kafka = SimpleKafka()
         self.assertEqual(kafka.log, [])
-        self.assertEqual(kafka.time_idx, [])
+        self.assertEqual(kafka._ts_list, [])
+        self.assertEqual(kafka._ts_offsets, [])
         self.assertIsNone(kafka.file_path)
     
     def test_init_with_nonexistent_file(self):
@@ -28,24 +51,25 @@ class TestSimpleKafka(unittest.TestCase):
             temp_path = tmp.name
         kafka = SimpleKafka(temp_path)
         self.assertEqual(kafka.log, [])
-        self.assertEqual(kafka.time_idx, [])
+        self.assertEqual(kafka._ts_list, [])
+        self.assertEqual(kafka._ts_offsets, [])
         self.assertEqual(kafka.file_path, temp_path)
     
     def test_init_with_existing_file(self):
         """Test initialization with existing file containing data"""
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.json') as tmp:
-            test_data = [
-                {"offset": 0, "key": "key1", "value": "value1", "timestamp": "2023-01-01T00:00:00"},
-                {"offset": 1, "key": "key2", "value": "value2", "timestamp": "2023-01-01T01:00:00"}
-            ]
-            json.dump(test_data, tmp, indent=2)
-            self.temp_file = tmp.name
+        test_data = [
+            {"offset": 0, "key": "key1", "value": "value1", "timestamp": "2023-01-01T00:00:00"},
+            {"offset": 1, "key": "key2", "value": "value2", "timestamp": "2023-01-01T01:00:00"}
+        ]
+        self._temp_log(''.join(json.dumps(message) + '\n' for message in test_data))
         
         kafka = SimpleKafka(self.temp_file)
         self.assertEqual(len(kafka.log), 2)
-        self.assertEqual(len(kafka.time_idx), 2)
+        self.assertEqual(len(kafka._ts_list), 2)
         self.assertEqual(kafka.log[0]["key"], "key1")
         self.assertEqual(kafka.log[1]["key"], "key2")
+        self.assertEqual(kafka.log[0]["timestamp"], parse_ts("2023-01-01T00:00:00"))
+        kafka.close()
     
     def test_produce_single_message(self):
         """Test producing a single message"""
@@ -53,13 +77,13 @@ class TestSimpleKafka(unittest.TestCase):
         
         self.assertEqual(offset, 0)
         self.assertEqual(len(self.kafka.log), 1)
-        self.assertEqual(len(self.kafka.time_idx), 1)
+        self.assertEqual(len(self.kafka._ts_list), 1)
         
         message = self.kafka.log[0]
         self.assertEqual(message["offset"], 0)
         self.assertEqual(message["key"], "test_key")
         self.assertEqual(message["value"], "test_value")
-        self.assertIsInstance(message["timestamp"], str)
+        self.assertIsInstance(message["timestamp"], int)
     
     def test_produce_multiple_messages(self):
         """Test producing multiple messages"""
@@ -71,10 +95,10 @@ class TestSimpleKafka(unittest.TestCase):
         self.assertEqual(offset2, 1)
         self.assertEqual(offset3, 2)
         self.assertEqual(len(self.kafka.log), 3)
-        self.assertEqual(len(self.kafka.time_idx), 3)
+        self.assertEqual(len(self.kafka._ts_list), 3)
         
-        timestamps = [item["timestamp"] for item in self.kafka.time_idx]
-        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertEqual(self.kafka._ts_list, sorted(self.kafka._ts_list))
+        self.assertEqual(self.kafka._ts_offsets, [0, 1, 2])
     
     def test_consume_valid_offset(self):
         """Test consuming messages from valid offset"""
@@ -117,21 +141,23 @@ class TestSimpleKafka(unittest.TestCase):
     def test_consume_at_time_exact_match(self):
         """Test consuming at exact timestamp"""
         
-        timestamp1 = "2023-01-01T00:00:00"
-        timestamp2 = "2023-01-01T01:00:00"
+        timestamp1 = parse_ts("2023-01-01T00:00:00")
+        timestamp2 = parse_ts("2023-01-01T01:00:00")
         
         self.kafka.log = [
             {"offset": 0, "key": "key1", "value": "value1", "timestamp": timestamp1},
             {"offset": 1, "key": "key2", "value": "value2", "timestamp": timestamp2}
         ]
-        self.kafka.time_idx = [
-            {"offset": 0, "timestamp": timestamp1},
-            {"offset": 1, "timestamp": timestamp2}
-        ]
+        self.kafka._ts_list = [timestamp1, timestamp2]
+        self.kafka._ts_offsets = [0, 1]
         
         message = self.kafka.consume_at_time(timestamp1)
         self.assertIsNotNone(message)
         self.assertEqual(message["key"], "key1")
+        
+        message = self.kafka.consume_at_time("2023-01-01T01:00:00")
+        self.assertIsNotNone(message)
+        self.assertEqual(message["key"], "key2")
     
     def test_consume_at_time_before_messages(self):
         """Test consuming at timestamp before any messages"""
@@ -143,19 +169,48 @@ class TestSimpleKafka(unittest.TestCase):
     
     def test_consume_at_time_after_messages(self):
         """Test consuming at timestamp after messages"""
-        timestamp = "2023-01-01T00:00:00"
+        timestamp = parse_ts("2023-01-01T00:00:00")
         self.kafka.log = [
             {"offset": 0, "key": "key1", "value": "value1", "timestamp": timestamp}
         ]
-        self.kafka.time_idx = [
-            {"offset": 0, "timestamp": timestamp}
-        ]
+        self.kafka._ts_list = [timestamp]
+        self.kafka._ts_offsets = [0]
         
         future_timestamp = "2025-01-01T00:00:00"
         message = self.kafka.consume_at_time(future_timestamp)
         self.assertIsNotNone(message)
         self.assertEqual(message["key"], "key1")
     
+    def test_consume_at_time_between_messages(self):
+        """Test consuming at a timestamp that falls between two messages"""
+        timestamps = [parse_ts(f"2023-01-01T0{hour}:00:00") for hour in range(3)]
+        self.kafka.log = [
+            {"offset": i, "key": f"key{i}", "value": f"value{i}", "timestamp": timestamp}
+            for i, timestamp in enumerate(timestamps)
+        ]
+        self.kafka._ts_list = list(timestamps)
+        self.kafka._ts_offsets = [0, 1, 2]
+        
+        message = self.kafka.consume_at_time("2023-01-01T01:30:00")
+        self.assertIsNotNone(message)
+        self.assertEqual(message["key"], "key1")
+    
+    def test_timestamp_round_trip(self):
+        """Test converting between ISO strings and epoch nanoseconds"""
+        self.assertEqual(parse_ts("1970-01-01T00:00:01"), 1_000_000_000)
+        self.assertEqual(parse_ts("1970-01-01T01:00:01+01:00"), 1_000_000_000)
+        self.assertEqual(parse_ts(42), 42)
+        self.assertEqual(format_ts(1_000_000_000), "1970-01-01T00:00:01+00:00")
+        
+        #ISO strings carry microseconds, so formatting drops the sub-microsecond part
+        offset = self.kafka.produce("key1", "value1")
+        timestamp = self.kafka.log[offset]["timestamp"]
+        self.assertEqual(parse_ts(format_ts(timestamp)), timestamp - timestamp % 1000)
+    
+    def test_consume_at_time_empty_log(self):
+        """Test consuming at a timestamp from empty log"""
+        self.assertIsNone(self.kafka.consume_at_time("2023-01-01T00:00:00"))
+    
     def test_get_log(self):
         """Test getting entire log"""
         self.kafka.produce("key1", "value1")
@@ -170,20 +225,224 @@ class TestSimpleKafka(unittest.TestCase):
     
     def test_persistence_save_and_load(self):
         """Test saving to and loading from file"""
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.json') as tmp:
-            self.temp_file = tmp.name
+        self._temp_log()
+        
+        with SimpleKafka(self.temp_file) as kafka_with_file:
+            kafka_with_file.produce("key1", "value1")
+            kafka_with_file.produce("key2", "value2")
+        
+        self.assertTrue(os.path.exists(self.temp_file))
+        
+        with SimpleKafka(self.temp_file) as kafka_loaded:
+            self.assertEqual(len(kafka_loaded.log), 2)
+            self.assertEqual(kafka_loaded.log[0]["key"], "key1")
+            self.assertEqual(kafka_loaded.log[1]["key"], "key2")
+            self.assertEqual(len(kafka_loaded._ts_list), 2)
+    
+    def test_persistence_without_close(self):
+        """Test that buffered messages are written when an unclosed store is collected"""
+        self._temp_log()
         
         kafka_with_file = SimpleKafka(self.temp_file)
         kafka_with_file.produce("key1", "value1")
         kafka_with_file.produce("key2", "value2")
+        del kafka_with_file
         
-        self.assertTrue(os.path.exists(self.temp_file))
+        with SimpleKafka(self.temp_file) as kafka_loaded:
+            self.assertEqual([message["key"] for message in kafka_loaded.log], ["key1", "key2"])
+    
+    def test_produce_many(self):
+        """Test producing a batch of messages"""
+        self.kafka.produce("key0", "value0")
+        offsets = self.kafka.produce_many([("key1", "value1"), ("key2", "value2")])
+        
+        self.assertEqual(offsets, [1, 2])
+        self.assertEqual([message["key"] for message in self.kafka.log], ["key0", "key1", "key2"])
+        self.assertEqual(self.kafka._ts_offsets, [0, 1, 2])
+        self.assertEqual(self.kafka._ts_list, sorted(self.kafka._ts_list))
+    
+    def test_produce_many_empty_batch(self):
+        """Test producing an empty batch"""
+        self.assertEqual(self.kafka.produce_many([]), [])
+        self.assertEqual(self.kafka.log, [])
+    
+    def test_persistence_buffers_until_flush(self):
+        """Test that produced messages reach the file on flush or close"""
+        self._temp_log()
+        
+        kafka_with_file = SimpleKafka(self.temp_file)
+        kafka_with_file.produce_many([(f"key{i}", f"value{i}") for i in range(10)])
+        kafka_with_file.flush()
+        with SimpleKafka(self.temp_file) as kafka_loaded:
+            self.assertEqual(len(kafka_loaded.log), 10)
+        
+        kafka_with_file.produce("key10", "value10")
+        kafka_with_file.close()
+        with SimpleKafka(self.temp_file) as kafka_loaded:
+            self.assertEqual(len(kafka_loaded.log), 11)
+    
+    def test_persistence_appends_one_line_per_message(self):
+        """Test that each produce appends a JSON line instead of rewriting the file"""
+        self._temp_log()
+        
+        kafka_with_file = SimpleKafka(self.temp_file)
+        kafka_with_file.produce("key1", "value1")
+        kafka_with_file.produce("key2", "value2")
+        kafka_with_file.close()
+        
+        with open(self.temp_file) as f:
+            lines = f.read().splitlines()
+        self.assertEqual([json.loads(line)["key"] for line in lines], ["key1", "key2"])
+        
+        kafka_reopened = SimpleKafka(self.temp_file)
+        self.assertEqual(kafka_reopened.produce("key3", "value3"), 2)
+        kafka_reopened.close()
+        with SimpleKafka(self.temp_file) as kafka_loaded:
+            self.assertEqual(len(kafka_loaded.log), 3)
+    
+    def test_load_parses_messages_lazily(self):
+        """Test that reopening a log only parses the messages that are read"""
+        self._temp_log()
+        
+        kafka_with_file = SimpleKafka(self.temp_file)
+        for i in range(5):
+            kafka_with_file.produce(f"key{i}", f"value{i}")
+        kafka_with_file.close()
+        
+        kafka_loaded = SimpleKafka(self.temp_file)
+        self.assertEqual(kafka_loaded._unparsed, 5)
+        self.assertEqual(len(kafka_loaded._ts_list), 5)
+        self.assertEqual([message["key"] for message in kafka_loaded.consume(1, 2)], ["key1", "key2"])
+        self.assertEqual(kafka_loaded._unparsed, 3)
+        
+        timestamp = kafka_loaded._ts_list[3]
+        self.assertEqual(kafka_loaded.consume_at_time(timestamp)["timestamp"], timestamp)
+        
+        self.assertEqual(kafka_loaded.produce("key5", "value5"), 5)
+        kafka_loaded.close()
+        with SimpleKafka(self.temp_file) as kafka_reopened:
+            self.assertEqual([message["key"] for message in kafka_reopened.log],
+                             [f"key{i}" for i in range(6)])
+    
+    def test_close_keeps_messages_unparsed(self):
+        """Test that closing a loaded log does not parse the messages left"""
+        self._temp_log()
+        
+        with SimpleKafka(self.temp_file) as kafka_with_file:
+            kafka_with_file.produce_many([(f"key{i}", f"value{i}") for i in range(5)])
+        
+        kafka_loaded = SimpleKafka(self.temp_file)
+        kafka_loaded.consume(0, 1)
+        kafka_loaded.close()
+        self.assertEqual(kafka_loaded._unparsed, 4)
+        self.assertEqual(kafka_loaded.consume(3, 1)[0]["key"], "key3")
+        self.assertEqual(kafka_loaded._unparsed, 3)
+    
+    def test_load_rebuilds_stale_time_index(self):
+        """Test that a time index that does not match the log is rebuilt"""
+        self._temp_log()
+        
+        kafka_with_file = SimpleKafka(self.temp_file)
+        kafka_with_file.produce("key1", "value1")
+        kafka_with_file.produce("key2", "value2")
+        kafka_with_file.close()
+        with open(self.temp_file + TIME_INDEX_SUFFIX, 'r+b') as f:
+            f.truncate(8)
+        
+        with SimpleKafka(self.temp_file) as kafka_loaded:
+            self.assertEqual([message["key"] for message in kafka_loaded.log], ["key1", "key2"])
+        self.assertEqual(os.path.getsize(self.temp_file + TIME_INDEX_SUFFIX), 16)
+    
+    def test_load_converts_json_array_log(self):
+        """Test that a log saved as one JSON array is converted to JSON lines"""
+        self._temp_log(json.dumps([
+            {"offset": 0, "key": "key1", "value": "value1", "timestamp": "2023-01-01T00:00:00"},
+            {"offset": 1, "key": "key2", "value": "value2", "timestamp": "2023-01-01T01:00:00"}
+        ], indent=2))
+        
+        kafka_loaded = SimpleKafka(self.temp_file)
+        self.assertEqual([message["key"] for message in kafka_loaded.log], ["key1", "key2"])
+        self.assertEqual(kafka_loaded.produce("key3", "value3"), 2)
+        kafka_loaded.close()
+        
+        with open(self.temp_file) as f:
+            self.assertEqual([json.loads(line)["offset"] for line in f], [0, 1, 2])
+        kafka_reopened = SimpleKafka(self.temp_file)
+        self.assertEqual(kafka_reopened.log[0]["timestamp"], parse_ts("2023-01-01T00:00:00"))
+        kafka_reopened.close()
+    
+    def test_load_drops_torn_last_line(self):
+        """Test that only a partially written last line is dropped on load"""
+        lines = [json.dumps({"offset": i, "key": f"key{i}", "value": "v", "timestamp": i}) + '\n'
+                 for i in range(2)]
+        self._temp_log(''.join(lines) + '{"offset": 2, "ke')
         
         kafka_loaded = SimpleKafka(self.temp_file)
         self.assertEqual(len(kafka_loaded.log), 2)
-        self.assertEqual(kafka_loaded.log[0]["key"], "key1")
-        self.assertEqual(kafka_loaded.log[1]["key"], "key2")
-        self.assertEqual(len(kafka_loaded.time_idx), 2)
+        self.assertEqual(kafka_loaded.produce("key2", "value2"), 2)
+        kafka_loaded.close()
+        
+        kafka_reopened = SimpleKafka(self.temp_file)
+        self.assertEqual([message["offset"] for message in kafka_reopened.log], [0, 1, 2])
+        kafka_reopened.close()
+    
+    def test_load_rejects_invalid_line_before_the_end(self):
+        """Test that a log with an invalid line before its end is not loaded as empty"""
+        self._temp_log('{"offset": 0, "ke\n'
+                       + json.dumps({"offset": 1, "key": "key1", "value": "v", "timestamp": 1}) + '\n')
+        
+        with self.assertRaises(ValueError):
+            SimpleKafka(self.temp_file)
+        #the index is only written after the whole log parsed
+        self.assertFalse(os.path.exists(self.temp_file + TIME_INDEX_SUFFIX))
+    
+    def test_persistence_round_trips_values_like_json(self):
+        """Test that values are stored as the json module would store them"""
+        self._temp_log()
+        
+        request_id = uuid.UUID(int=1)
+        values = [{1: "a"}, 2 ** 70, -2 ** 63 - 1, [float("nan")], request_id, {Color.RED: Color.RED}]
+        with SimpleKafka(self.temp_file) as kafka_with_file:
+            for value in values:
+                kafka_with_file.produce("key", value)
+            for value in (datetime(2023, 1, 1), Point(1, 2)):
+                with self.assertRaises(TypeError):
+                    kafka_with_file.produce("key", value)
+        
+        with SimpleKafka(self.temp_file) as kafka_loaded:
+            self.assertEqual([message["value"] for message in kafka_loaded.log],
+                             [{"1": "a"}, 2 ** 70, -2 ** 63 - 1, [None], str(request_id), {"red": "red"}])
+    
+    def test_produce_unserializable_value_leaves_log_unchanged(self):
+        """Test that a value that cannot be written is not added to the log"""
+        self._temp_log()
+        
+        with SimpleKafka(self.temp_file) as kafka_with_file:
+            kafka_with_file.produce("key0", "value0")
+            with self.assertRaises(TypeError):
+                kafka_with_file.produce("key1", {"value"})
+            with self.assertRaises(TypeError):
+                kafka_with_file.produce_many([("key1", "value1"), ("key2", {"value"})])
+            self.assertEqual(len(kafka_with_file.log), 1)
+            self.assertEqual(kafka_with_file._ts_offsets, [0])
+            self.assertEqual(kafka_with_file.produce("key1", "value1"), 1)
+        
+        with SimpleKafka(self.temp_file) as kafka_loaded:
+            self.assertEqual([message["offset"] for message in kafka_loaded.log], [0, 1])
+    
+    def test_persistence_writes_compact_json(self):
+        """Test that log lines are written without indentation or padding"""
+        self._temp_log()
+        
+        kafka_with_file = SimpleKafka(self.temp_file)
+        kafka_with_file.produce("key1", {"nested": [1, 2]})
+        kafka_with_file.close()
+        
+        with open(self.temp_file) as f:
+            line = f.read()
+        self.assertTrue(line.endswith('\n'))
+        self.assertNotIn(' ', line)
+        self.assertEqual(json.loads(line)["value"], {"nested": [1, 2]})
 
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
@@ -1,22 +1,87 @@
-from collections import deque
-from typing import Any, Tuple
+from typing import Any, List, Tuple
+import bisect
+import itertools
 import math
 
+#resize once the average bucket holds more than this many events
+MAX_EVENTS_PER_BUCKET = 8
+#number of earliest events sampled to pick a new bucket width
+WIDTH_SAMPLE_SIZE = 25
+
+
 class CalendarQueue:
+    #fixed attribute layout: no per-instance __dict__ on the hot paths
+    __slots__ = (
+        "bucket_width",
+        "num_buckets",
+        "_inv_width",
+        "_mask",
+        "bucket_ts",
+        "bucket_ev",
+        "_current_time",
+        "_stale_possible",
+        "event_count",
+        "last_bucket",
+        "_slot",
+        "head_ts",
+        "_grow_threshold",
+        "_shrink_threshold",
+        "_bucket_pool",
+    )
+    
     def __init__(self, bucket_width: float = 1.0, initial_buckets: int = 8):
         """
         Initialize the Calendar Queue.
         
         Args:
             bucket_width: Initial time interval per bucket (e.g., 1.0 seconds).
-            initial_buckets: Initial number of buckets (power of 2 recommended).
+            initial_buckets: Initial number of buckets, must be a power of 2.
+        
+        Raises:
+            ValueError: If bucket_width is not positive or initial_buckets is not
+                a power of 2.
         """
+        if not bucket_width > 0:
+            raise ValueError("Bucket width must be positive")
+        if initial_buckets < 1 or initial_buckets & (initial_buckets - 1):
+            raise ValueError("Number of buckets must be a power of 2")
+        
         self.bucket_width = bucket_width
         self.num_buckets = initial_buckets
-        self.buckets = [deque() for _ in range(self.num_buckets)]
-        self.current_time = 0.0
+        #slot = int(timestamp * _inv_width), bucket = slot & _mask
+        self._inv_width = 1.0 / bucket_width
+        self._mask = initial_buckets - 1
+        #per bucket: sorted timestamps and the events at the same positions
+        self.bucket_ts = [[] for _ in range(self.num_buckets)]
+        self.bucket_ev = [[] for _ in range(self.num_buckets)]
+        self._current_time = 0.0
+        #set when current_time is moved by hand, which can leave events behind it
+        self._stale_possible = False
         self.event_count = 0
         self.last_bucket = 0
+        #absolute slot (timestamp / bucket_width) the last_bucket cursor is on
+        self._slot = 0
+        #timestamp of each bucket's first event, inf when the bucket is empty; entries
+        #alias the float objects already in bucket_ts, so the cache costs one pointer
+        #(8 bytes) per bucket and no float allocations
+        self.head_ts = [math.inf] * self.num_buckets
+        self._set_resize_thresholds()
+        #emptied bucket lists left over from shrinking, reused when growing
+        self._bucket_pool = []
+    
+    @property
+    def current_time(self) -> float:
+        """Timestamp of the last dequeued event; earlier events cannot be scheduled."""
+        return self._current_time
+    
+    @current_time.setter
+    def current_time(self, value: float) -> None:
+        self._current_time = value
+        #events before the new time are dropped on the next peek/dequeue, and the
+        #walk restarts from the new time's slot
+        self._stale_possible = self.event_count > 0
+        self._slot = int(value * self._inv_width)
+        self.last_bucket = self._slot & self._mask
     
     def enqueue(self, timestamp: float, event: Any) -> None:
         """
@@ -26,29 +91,32 @@ class CalendarQueue:
             timestamp: Time when the event should occur.
             event: The event data.
         """
-        if timestamp < self.current_time:
+        if timestamp < self._current_time:
             raise ValueError("Cannot schedule event in the past")
         
-        bucket_idx = int((timestamp // self.bucket_width) % self.num_buckets)
-        bucket = self.buckets[bucket_idx]
-        
-        #find pos to insert the event to maintain chronological order
-        bucket_list = list(bucket)
-        inserted = False
+        bucket_idx = int(timestamp * self._inv_width) & self._mask
         
-        for i, (t, _) in enumerate(bucket_list):
-            if timestamp <= t:
-                bucket_list.insert(i, (timestamp, event))
-                inserted = True
-                break
-        
-        if not inserted:
-            bucket_list.append((timestamp, event))
-        
-        self.buckets[bucket_idx] = deque(bucket_list)
+        bucket_ts = self.bucket_ts[bucket_idx]
+        if not bucket_ts:
+            bucket_ts.append(timestamp)
+            self.bucket_ev[bucket_idx].append(event)
+            self.head_ts[bucket_idx] = timestamp
+        elif timestamp >= bucket_ts[-1]:
+            #events mostly arrive in time order, so appending at the tail is the common case
+            bucket_ts.append(timestamp)
+            self.bucket_ev[bucket_idx].append(event)
+        else:
+            #binary search on the timestamps only, so payloads are never compared
+            pos = bisect.bisect_right(bucket_ts, timestamp)
+            bucket_ts.insert(pos, timestamp)
+            self.bucket_ev[bucket_idx].insert(pos, event)
+            if pos == 0:
+                self.head_ts[bucket_idx] = timestamp
         
         self.event_count += 1
-        self._resize_if_needed()
+        #the grow check is inlined so the common enqueue makes no extra method call
+        if self.event_count > self._grow_threshold:
+            self._resize_if_needed()
     
     def dequeue(self) -> Tuple[float, Any]:
         """
@@ -63,33 +131,21 @@ class CalendarQueue:
         if self.event_count == 0:
             raise IndexError("Queue is empty")
         
-        earliest_timestamp = float('inf')
-        earliest_bucket_idx = -1
-        earliest_event = None
-        
-        for bucket_idx in range(self.num_buckets):
-            bucket = self.buckets[bucket_idx]
-            
-            #remove events that are in the past
-            while bucket and bucket[0][0] < self.current_time:
-                bucket.popleft()
-                self.event_count -= 1
-            
-            if bucket and bucket[0][0] >= self.current_time:
-                if bucket[0][0] < earliest_timestamp:
-                    earliest_timestamp = bucket[0][0]
-                    earliest_bucket_idx = bucket_idx
-                    earliest_event = bucket[0][1]
-        
-        if earliest_bucket_idx == -1:
-            raise IndexError("No valid events found")
-        
-        self.buckets[earliest_bucket_idx].popleft()
+        bucket_idx, slot = self._earliest_bucket()
+        bucket_ts = self.bucket_ts[bucket_idx]
+        earliest_timestamp = bucket_ts.pop(0)
+        earliest_event = self.bucket_ev[bucket_idx].pop(0)
+        self.head_ts[bucket_idx] = bucket_ts[0] if bucket_ts else math.inf
         self.event_count -= 1
-        self.current_time = max(self.current_time, earliest_timestamp)
-        self.last_bucket = earliest_bucket_idx
+        self._current_time = earliest_timestamp
+        self.last_bucket = bucket_idx
+        #the walk only leaves the current year through the direct search, which
+        #means the calendar has gone sparse, so that's when shrinking is checked
+        sparse = slot - self._slot >= self.num_buckets
+        self._slot = slot
         
-        self._resize_if_needed()
+        if sparse:
+            self._resize_if_needed()
         return earliest_timestamp, earliest_event
     
     def peek(self) -> Tuple[float, Any]:
@@ -105,77 +161,143 @@ class CalendarQueue:
         if self.event_count == 0:
             raise IndexError("Queue is empty")
         
-        earliest_timestamp = float('inf')
-        earliest_event = None
+        bucket_idx, _ = self._earliest_bucket()
+        return self.bucket_ts[bucket_idx][0], self.bucket_ev[bucket_idx][0]
+    
+    def _earliest_bucket(self) -> Tuple[int, int]:
+        """
+        Find the bucket holding the earliest event with the calendar walk.
         
-        for bucket_idx in range(self.num_buckets):
-            bucket = self.buckets[bucket_idx]
-            
-            while bucket and bucket[0][0] < self.current_time:
-                bucket.popleft()
-                self.event_count -= 1
-            
-            if bucket and bucket[0][0] >= self.current_time:
-                if bucket[0][0] < earliest_timestamp:
-                    earliest_timestamp = bucket[0][0]
-                    earliest_event = bucket[0][1]
-        
-        if earliest_event is None:
+        Starting from the last_bucket cursor, buckets are visited one slot at a
+        time; the first bucket whose head falls in the slot being visited holds
+        the earliest event. If a whole year passes without a hit, the walk jumps
+        straight to the bucket with the smallest head timestamp.
+        
+        Returns:
+            Tuple of (bucket index, absolute slot of its first event).
+        
+        Raises:
+            IndexError: If no event at or after current_time is left.
+        """
+        if self._stale_possible:
+            self._drop_past()
+        
+        inv_width = self._inv_width
+        mask = self._mask
+        head_ts = self.head_ts
+        bucket_idx = self.last_bucket
+        
+        #a head lies in the visited slot when int(head * inv_width) <= slot, that is
+        #head * inv_width < slot + 1; empty buckets hold inf and never match
+        slot_end = self._slot + 1
+        for _ in range(self.num_buckets):
+            if head_ts[bucket_idx] * inv_width < slot_end:
+                return bucket_idx, slot_end - 1
+            bucket_idx = (bucket_idx + 1) & mask
+            slot_end += 1
+        
+        #empty year - direct search, min/index reduce the head cache in C
+        earliest_timestamp = min(head_ts)
+        if earliest_timestamp == math.inf:
             raise IndexError("No valid events found")
         
-        return earliest_timestamp, earliest_event
+        return head_ts.index(earliest_timestamp), int(earliest_timestamp * inv_width)
+    
+    def _drop_past(self) -> None:
+        """Remove events that are in the past after current_time was moved."""
+        for bucket_idx in range(self.num_buckets):
+            if self.head_ts[bucket_idx] < self._current_time:
+                bucket_ts = self.bucket_ts[bucket_idx]
+                stale = bisect.bisect_left(bucket_ts, self._current_time)
+                del bucket_ts[:stale]
+                del self.bucket_ev[bucket_idx][:stale]
+                self.event_count -= stale
+                self.head_ts[bucket_idx] = bucket_ts[0] if bucket_ts else math.inf
+        self._stale_possible = False
     
     def _resize_if_needed(self) -> None:
-        """Resize the queue if too sparse or too dense."""
-        if self.event_count <= 2:
+        """
+        Resize the queue if too sparse or too dense.
+        
+        The bucket count doubles or halves, so the thresholds it is checked against
+        move geometrically and the queue rebuilds O(log N) times while growing to N
+        events. Each check between resizes is two integer comparisons.
+        """
+        if self._shrink_threshold <= self.event_count <= self._grow_threshold:
             return
-            
-        avg_events_per_bucket = self.event_count / self.num_buckets
-        
-        should_resize = False
-        new_bucket_width = self.bucket_width
-        new_num_buckets = self.num_buckets
-        
-        if avg_events_per_bucket > 8:
-            #too dense - increase bucket width and number of buckets
-            new_bucket_width *= 2
-            new_num_buckets *= 2
-            should_resize = True
-        elif avg_events_per_bucket < 2:
-            #too sparse - decrease bucket width and number of buckets
-            new_bucket_width /= 2
+        
+        if self.event_count > self._grow_threshold:
+            #too dense - double the number of buckets
+            new_num_buckets = self.num_buckets * 2
+        else:
+            #too sparse - halve the number of buckets
             new_num_buckets = max(4, self.num_buckets // 2)
-            should_resize = True
-        
-        if should_resize:
-            events = []
-            for bucket in self.buckets:
-                while bucket:
-                    events.append(bucket.popleft())
-            
-            self.bucket_width = new_bucket_width
-            self.num_buckets = new_num_buckets
-            self.buckets = [deque() for _ in range(self.num_buckets)]
-            self.event_count = 0
-            
-            for timestamp, event in events:
-                bucket_idx = int((timestamp // self.bucket_width) % self.num_buckets)
-                bucket = self.buckets[bucket_idx]
-                
-                bucket_list = list(bucket)
-                inserted = False
-                
-                for i, (t, _) in enumerate(bucket_list):
-                    if timestamp <= t:
-                        bucket_list.insert(i, (timestamp, event))
-                        inserted = True
-                        break
-                
-                if not inserted:
-                    bucket_list.append((timestamp, event))
-                
-                self.buckets[bucket_idx] = deque(bucket_list)
-                self.event_count += 1
+            if new_num_buckets == self.num_buckets or self.event_count <= 2:
+                return
+        
+        #every bucket is already a sorted run, and list.sort merges runs instead of
+        #re-sorting them, so putting the positions in time order is a k-way merge done
+        #in C; the sort is stable and equal timestamps always share a bucket, so their
+        #order is kept
+        timestamps = list(itertools.chain.from_iterable(self.bucket_ts))
+        events = list(itertools.chain.from_iterable(self.bucket_ev))
+        order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+        
+        self.bucket_width = self._estimate_width([timestamps[pos] for pos in order[:WIDTH_SAMPLE_SIZE]])
+        self.num_buckets = new_num_buckets
+        self._inv_width = 1.0 / self.bucket_width
+        self._mask = new_num_buckets - 1
+        self._reset_buckets()
+        
+        #events arrive in time order, so each new bucket is filled with appends
+        inv_width = self._inv_width
+        mask = self._mask
+        for pos in order:
+            timestamp = timestamps[pos]
+            bucket_idx = int(timestamp * inv_width) & mask
+            self.bucket_ts[bucket_idx].append(timestamp)
+            self.bucket_ev[bucket_idx].append(events[pos])
+        
+        self.head_ts[:] = [bucket_ts[0] if bucket_ts else math.inf for bucket_ts in self.bucket_ts]
+        self._slot = int(self._current_time * self._inv_width)
+        self.last_bucket = self._slot & self._mask
+        self._set_resize_thresholds()
+    
+    def _reset_buckets(self) -> None:
+        """Empty the bucket lists and fit them to num_buckets, recycling spares."""
+        pool = self._bucket_pool
+        for buckets in (self.bucket_ts, self.bucket_ev):
+            for bucket in buckets:
+                bucket.clear()
+            while len(buckets) > self.num_buckets:
+                pool.append(buckets.pop())
+            while len(buckets) < self.num_buckets:
+                buckets.append(pool.pop() if pool else [])
+    
+    def _estimate_width(self, sample: List[float]) -> float:
+        """
+        Pick a bucket width of about three times the gap between the earliest events.
+        
+        Gaps more than twice the average are treated as outliers and left out,
+        so a few far-future events do not stretch every bucket.
+        
+        Args:
+            sample: Timestamps of the earliest events, in ascending order
+        """
+        gaps = [later - earlier for earlier, later in zip(sample, sample[1:])]
+        if not gaps:
+            return self.bucket_width
+        
+        avg_gap = sum(gaps) / len(gaps)
+        close_gaps = [gap for gap in gaps if gap <= 2 * avg_gap]
+        avg_gap = sum(close_gaps) / len(close_gaps)
+        
+        return 3 * avg_gap if avg_gap > 0 else self.bucket_width
+    
+    def _set_resize_thresholds(self) -> None:
+        """Set the event counts that trigger the next grow or shrink."""
+        self._grow_threshold = self.num_buckets * MAX_EVENTS_PER_BUCKET
+        self._shrink_threshold = self.num_buckets // 2
     
     def is_empty(self) -> bool:
         """Check if the queue is empty."""
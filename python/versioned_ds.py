@@ -23,79 +23,363 @@ let's implement a "simple" version of this with:
     - an append-only log for versioning
     - support for producing and consuming messages
     - time-based and offset-based message retrieval
-    - basic persistence to disk using JSON
+    - basic persistence to disk as an append-only file of JSON lines, one message per line,
+      plus a time index file of message timestamps so reopening a log does not parse it
+
+Writes are buffered: a produced message is on disk after flush(), close() or leaving a
+`with SimpleKafka(path)` block. Messages still buffered when the store is garbage
+collected or the interpreter exits are flushed then, so only a crash can lose them.
 '''
 
+import enum
 import json
-from datetime import datetime, timezone
+import math
+import re
+import uuid
+from array import array
+from datetime import datetime, timedelta, timezone
 import bisect
-from typing import Optional, Dict, List
+import mmap
+import os
+import time
+import weakref
+from typing import Optional, Dict, Iterable, List, Tuple, Union
+
+try:
+    import orjson
+except ImportError: #optional, the stdlib json module is the fallback
+    orjson = None
+
+#buffered messages are written out once this many are pending...
+FLUSH_EVERY = 256
+#...or once this many seconds passed since the last write, checked on produce
+FLUSH_INTERVAL = 0.05
+#companion file next to the log: one int64 timestamp per message, in offset order
+TIME_INDEX_SUFFIX = '.timeindex'
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+if orjson is not None:
+    _ORJSON_OPTIONS = (orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS
+                       | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+
+#orjson reads integers outside [-2**63, 2**64) as floats, so lines with a number that
+#could be one use json; 19-digit positives such as nanosecond timestamps stay on orjson
+_LONG_NUMBER = re.compile(rb'-\d{19}|\d{20}')
+
+def _dumps(message: Dict) -> bytes:
+    """Serialize one message as a compact JSON line, the same with or without orjson"""
+    if orjson is not None:
+        try:
+            #datetimes and dataclasses are handed to _reject, so like json they raise
+            return orjson.dumps(message, default=_reject, option=_ORJSON_OPTIONS)
+        except TypeError: #integers beyond 64 bits, which the json module handles
+            pass
+    try:
+        line = json.dumps(message, separators=(',', ':'), allow_nan=False)
+    except (TypeError, ValueError):
+        line = json.dumps(_normalize(message), separators=(',', ':'), allow_nan=False)
+    return (line + '\n').encode()
+
+def _loads(data: bytes):
+    """Parse JSON with orjson where it gives the same result as the json module"""
+    if orjson is not None and not _LONG_NUMBER.search(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError: #e.g. NaN in logs written before orjson was used
+            pass
+    return json.loads(data)
+
+def _reject(value):
+    """orjson default hook: refuse every type the json module cannot encode either"""
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _normalize(value):
+    """Copy value as orjson encodes it: non-finite floats as None, UUIDs as str, enums by value"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {_normalize(key): _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, enum.Enum):
+        return _normalize(value.value)
+    return value
+
+def _flush_pending(file_path: str, pending: List[bytes], pending_ts: array) -> None:
+    """Write lines left buffered by a SimpleKafka that was never closed"""
+    if pending:
+        with open(file_path, 'ab') as f:
+            f.write(b''.join(pending))
+        with open(file_path + TIME_INDEX_SUFFIX, 'ab') as f:
+            f.write(pending_ts.tobytes())
+        pending.clear()
+        del pending_ts[:]
+
+def parse_ts(timestamp: Union[int, str]) -> int:
+    """Convert an ISO 8601 string (UTC if no offset is given) to epoch nanoseconds"""
+    if isinstance(timestamp, int):
+        return timestamp
+    dt = datetime.fromisoformat(timestamp)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _EPOCH) // timedelta(microseconds=1) * 1000
+
+def format_ts(timestamp_ns: int) -> str:
+    """Format epoch nanoseconds as an ISO 8601 UTC string, for display"""
+    return (_EPOCH + timedelta(microseconds=timestamp_ns // 1000)).isoformat()
 
 class SimpleKafka:
     def __init__(self, file_path = None):
-        self.log = [] #[{offset, key, value, timestamp}]
-        self.time_idx = [] #[{timestamp, idx}] sorted by timestamp
+        #[{offset, key, value, timestamp}], timestamp in epoch nanoseconds; None for
+        #messages loaded from the file that have not been parsed yet
+        self._messages = []
+        self._unparsed = 0 #number of None entries in _messages
+        self._mm = None #read-only map of the log file as it was when loaded
+        self._line_starts = array('q') #byte position of each loaded line, plus the end
+        #time index as two parallel lists sorted by timestamp, so bisect needs no key
+        self._ts_list = [] #[timestamp]
+        self._ts_offsets = [] #[offset] of the message with the timestamp at the same position
         self.file_path = file_path
+        self._fp = None #append handle, opened on the first write
+        self._pending = [] #serialized lines not written to the file yet
+        self._pending_ts = array('q') #timestamps of the pending lines, for the time index
+        self._index_fp = None #append handle of the time index file
+        self._last_flush = time.monotonic()
         if file_path:
             self._load()
+            #the buffers are only ever cleared in place, so the finalizer sees what is left
+            weakref.finalize(self, _flush_pending, file_path, self._pending, self._pending_ts)
+    
+    def __enter__(self) -> 'SimpleKafka':
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+    
+    @property
+    def log(self) -> List[Dict]:
+        """All messages, parsing the ones not read from the file yet"""
+        self._parse_all()
+        return self._messages
+    
+    @log.setter
+    def log(self, messages: List[Dict]) -> None:
+        self._messages = messages
+        self._unparsed = 0
             
     def produce(self, key, value):
         """Append a message to the log and return its offset"""
-        offset = len(self.log)
-        timestamp = datetime.now(timezone.utc).isoformat()
+        offset = len(self._messages)
+        timestamp = time.time_ns()
         message = {
             "offset": offset,
             "key": key,
             "value": value,
             "timestamp": timestamp
         }
-        self.log.append(message)
-        bisect.insort(self.time_idx, {"offset": offset, "timestamp": timestamp}, key=lambda x: x["timestamp"])
-        if self.file_path:
-            self._save()
+        #serialize first, so a message that cannot be written leaves the log unchanged
+        line = _dumps(message) if self.file_path else None
+        self._messages.append(message)
+        idx = bisect.bisect_right(self._ts_list, timestamp)
+        self._ts_list.insert(idx, timestamp)
+        self._ts_offsets.insert(idx, offset)
+        if line is not None:
+            self._append(line, timestamp)
         return offset
     
+    def produce_many(self, items: Iterable[Tuple]) -> List[int]:
+        """Append (key, value) pairs to the log as one batch and return their offsets"""
+        first_offset = len(self._messages)
+        timestamp = time.time_ns()
+        messages = [
+            {"offset": offset, "key": key, "value": value, "timestamp": timestamp}
+            for offset, (key, value) in enumerate(items, first_offset)
+        ]
+        lines = [_dumps(message) for message in messages] if self.file_path else None
+        self._messages.extend(messages)
+        offsets = range(first_offset, len(self._messages))
+        #the batch shares one timestamp, so it goes into the time index as one slice
+        idx = bisect.bisect_right(self._ts_list, timestamp)
+        self._ts_list[idx:idx] = [timestamp] * len(messages)
+        self._ts_offsets[idx:idx] = offsets
+        if lines is not None:
+            self._pending.extend(lines)
+            self._pending_ts.extend([timestamp] * len(messages))
+            self._flush_if_due()
+        return list(offsets)
+    
     def consume(self, start_offset, limit=10):
         """Read messages starting from start_offset, up to limit messages"""
-        if start_offset < 0 or start_offset >= len(self.log):
+        if start_offset < 0 or start_offset >= len(self._messages):
             return []
-        end_offset = min(start_offset + limit, len(self.log))
-        return self.log[start_offset:end_offset]
+        end_offset = min(start_offset + limit, len(self._messages))
+        return [self._message(offset) for offset in range(start_offset, end_offset)]
 
-    def consume_at_time(self, time_str: str) -> Optional[Dict]:
-        """Get the first message at or before the given timestamp."""
-        if not self.time_idx:
-            return None
-        
-        target_time = time_str
-        timestamps = [item["timestamp"] for item in self.time_idx]
-        idx = bisect.bisect_right(timestamps, target_time)
-        
+    def consume_at_time(self, timestamp: Union[int, str]) -> Optional[Dict]:
+        """Get the first message at or before the given timestamp (epoch ns or ISO string)."""
+        idx = bisect.bisect_right(self._ts_list, parse_ts(timestamp))
         if idx == 0:
             return None
-        offset = self.time_idx[idx - 1]["offset"]
-        return self.log[offset]
+        return self._message(self._ts_offsets[idx - 1])
     
     def get_log(self) -> List[Dict]:
         """Return the entire log."""
         return self.log
         
+    def flush(self) -> None:
+        """Write buffered messages to the log file"""
+        if self._pending:
+            if self._fp is None:
+                self._fp = open(self.file_path, 'ab')
+            self._fp.write(b''.join(self._pending))
+            self._fp.flush()
+            self._pending.clear()
+            #the index is written after the log, so a crash in between leaves it short
+            #and _load rebuilds it
+            if self._index_fp is None:
+                self._index_fp = open(self.file_path + TIME_INDEX_SUFFIX, 'ab')
+            self._index_fp.write(self._pending_ts.tobytes())
+            self._index_fp.flush()
+            del self._pending_ts[:]
+        self._last_flush = time.monotonic()
+    
+    def close(self) -> None:
+        """Flush buffered messages and close the log and index files"""
+        self.flush()
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        if self._index_fp is not None:
+            self._index_fp.close()
+            self._index_fp = None
+        if self._mm is not None:
+            #messages not parsed yet are read back from the file if they are asked for
+            self._mm.close()
+            self._mm = None
+        
     def _load(self) -> None:
-        """Load log from file and build time index"""
+        """
+        Map the log file and build the time index without parsing the messages.
+        
+        Timestamps come from the time index file; messages are parsed on first access.
+        If the index is missing or does not match the log, the log is parsed once and
+        the index rewritten.
+        
+        Raises:
+            ValueError: If the log holds invalid JSON anywhere but its last line
+        """
         try:
-            with open(self.file_path, 'r') as f:
-                self.log = json.load(f)
-                self.time_idx = [
-                    {"offset": msg["offset"], "timestamp": msg["timestamp"]}
-                    for msg in self.log
-                ]
-                self.time_idx.sort(key=lambda x: x["timestamp"])
-        except(FileNotFoundError, json.JSONDecodeError):
-            self.log = []
-            self.time_idx = []
+            with open(self.file_path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size:
+                    self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            pass
+        if self._mm is None:
+            return
+        
+        line_starts = array('q', [0])
+        pos = self._mm.find(b'\n')
+        while pos != -1:
+            line_starts.append(pos + 1)
+            pos = self._mm.find(b'\n', pos + 1)
+        if line_starts[-1] != len(self._mm):
+            line_starts.append(len(self._mm))
+        
+        timestamps = array('q')
+        try:
+            with open(self.file_path + TIME_INDEX_SUFFIX, 'rb') as f:
+                timestamps.frombytes(f.read())
+        except (FileNotFoundError, ValueError):
+            del timestamps[:]
+        
+        if len(timestamps) == len(line_starts) - 1:
+            self._line_starts = line_starts
+            self._messages = [None] * len(timestamps)
+            self._unparsed = len(timestamps)
+        else:
+            timestamps = self._rebuild_index()
+        
+        time_idx = sorted(zip(timestamps, range(len(timestamps))))
+        self._ts_list = [timestamp for timestamp, _ in time_idx]
+        self._ts_offsets = [offset for _, offset in time_idx]
+    
+    def _parse_all(self) -> None:
+        """Parse every message still waiting in the mapped file"""
+        if self._unparsed:
+            for offset in range(len(self._messages)):
+                self._message(offset)
+    
+    def _rebuild_index(self) -> array:
+        """
+        Parse the whole log file and rewrite the time index file from it.
+        
+        A log in the old format (one JSON array) is converted to JSON lines, and a
+        last line torn by an interrupted write is dropped. The log file is rewritten
+        whenever it is not exactly one message per line, so line numbers stay offsets.
+        
+        Raises:
+            ValueError: If the log holds invalid JSON anywhere but its last line
+        """
+        self._mm.close()
+        self._mm = None
+        with open(self.file_path, 'rb') as f:
+            data = f.read()
+        
+        if data.lstrip()[:1] == b'[':
+            messages = _loads(data)
+        else:
+            lines = [line for line in data.split(b'\n') if line.strip()]
+            messages = []
+            for line_no, line in enumerate(lines):
+                try:
+                    messages.append(_loads(line))
+                except json.JSONDecodeError as e:
+                    if line_no < len(lines) - 1:
+                        raise ValueError(f"Invalid JSON on line {line_no} of {self.file_path}") from e
+        
+        for msg in messages:
+            msg["timestamp"] = parse_ts(msg["timestamp"])
+        if data.count(b'\n') != len(messages) or not data.endswith(b'\n'):
+            tmp_path = self.file_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(b''.join(_dumps(msg) for msg in messages))
+            os.replace(tmp_path, self.file_path)
+        self.log = messages
+        
+        #written only once the whole log parsed, so an index never vouches for a bad log
+        timestamps = array('q', [msg["timestamp"] for msg in messages])
+        with open(self.file_path + TIME_INDEX_SUFFIX, 'wb') as f:
+            f.write(timestamps.tobytes())
+        return timestamps
+    
+    def _message(self, offset: int) -> Dict:
+        """Return the message at offset, parsing it from the log file if needed"""
+        message = self._messages[offset]
+        if message is None:
+            start, end = self._line_starts[offset], self._line_starts[offset + 1]
+            if self._mm is not None:
+                line = self._mm[start:end]
+            else: #closed, the map is gone
+                with open(self.file_path, 'rb') as f:
+                    f.seek(start)
+                    line = f.read(end - start)
+            message = _loads(line)
+            message["timestamp"] = parse_ts(message["timestamp"])
+            self._messages[offset] = message
+            self._unparsed -= 1
+        return message
             
-    def _save(self) -> None:
-        """Save log to file"""
-        with open(self.file_path, 'w') as f:
-            json.dump(self.log, f, indent=2)
+    def _append(self, line: bytes, timestamp: int) -> None:
+        """Buffer one serialized message for the end of the log file"""
+        self._pending.append(line)
+        self._pending_ts.append(timestamp)
+        self._flush_if_due()
+    
+    def _flush_if_due(self) -> None:
+        """Flush once enough messages are pending or enough time has passed"""
+        if len(self._pending) >= FLUSH_EVERY or time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
         
\ No newline at end of file